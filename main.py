@@ -1,34 +1,79 @@
-import requests
+import asyncio
+import io
+import aiohttp
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import json
 from dotenv import load_dotenv
 import os
-import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2 import OperationalError
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
 # Load API key from .env file
 load_dotenv()
 
-def get_transaction_data():
-    url = os.getenv('API_URL') 
-    # Set up API request headers
-    headers = {
-        'x-api-key': os.getenv('API_KEY'),
-        'Content-Type': 'application/json'
-    }
-    
+# API and database settings, read once at import
+API_URL = os.getenv('API_URL')
+API_HEADERS = {
+    'x-api-key': os.getenv('API_KEY'),
+    'Content-Type': 'application/json'
+}
+DB_KW = dict(
+    database=os.getenv('DB_NAME'),
+    user=os.getenv('DB_USER'),
+    password=os.getenv('DB_PASSWORD'),
+    host=os.getenv('DB_HOST'),
+    port=os.getenv('DB_PORT')
+)
+
+# Database connection pool, created on first use
+_db_pool = None
+
+# Rows written per COPY buffer when staging transactions
+COPY_CHUNK_SIZE = 100_000
+
+# Maximum number of pooled keep-alive connections to the API
+HTTP_POOL_SIZE = 10
+
+def get_month_windows(start_date, end_date):
+    # Split the date range into calendar-month windows that can be fetched concurrently
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    if start > end:
+        raise ValueError(f"start_date {start_date} is after end_date {end_date}")
+    windows = []
+    for month_start in pd.date_range(start.replace(day=1), end, freq='MS'):
+        window_start = max(month_start, start)
+        window_end = min(month_start + pd.offsets.MonthEnd(0), end)
+        windows.append((window_start.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d')))
+    return windows
+
+async def fetch_transaction_window(session, url, start_date, end_date):
     # Define date range for data fetch
     payload = {
-        "start_date": "2023-01-01",
-        "end_date": "2023-01-31"
+        "start_date": start_date,
+        "end_date": end_date
     }
-
-    try:
-        # Make API request and convert to DataFrame
-        response = requests.post(url, json=payload, headers=headers)
+    async with session.post(url, json=payload) as response:
         response.raise_for_status()
-        df = pd.DataFrame(response.json())
+        # Accept JSON bodies regardless of the Content-Type the API sends
+        return await response.json(content_type=None)
+
+async def fetch_transaction_chunks(url, headers, month_windows):
+    # Share one pooled session so every window reuses the same keep-alive connections
+    connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, limit_per_host=HTTP_POOL_SIZE)
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        return await asyncio.gather(
+            *[fetch_transaction_window(session, url, start, end) for start, end in month_windows]
+        )
+
+def get_transaction_data(start_date="2023-01-01", end_date="2023-01-31"):
+    try:
+        # Fetch every month window concurrently and combine into one DataFrame
+        month_windows = get_month_windows(start_date, end_date)
+        chunks = asyncio.run(fetch_transaction_chunks(API_URL, API_HEADERS, month_windows))
+        df = pd.concat([pd.DataFrame(chunk) for chunk in chunks], ignore_index=True)
         print("Available columns:", df.columns.tolist())
         return df
     except Exception as e:
@@ -43,42 +88,63 @@ def clean_data(df):
     print("\n=== Data Cleaning Report ===")
     print(f"Original row count: {len(df)}")
     
-    # Create copy to avoid modifying original data
-    clean_df = df.copy()
+    # Clean in place; callers that still need the raw data should pass a copy
+    clean_df = df
     
     print("\nMissing values before cleaning:")
-    print(clean_df.isnull().sum())
+    print(len(clean_df) - clean_df.count())
     
     # Check for required columns
     available_columns = clean_df.columns.tolist()
-    critical_columns = [col for col in ['transaction_date'] if col in available_columns]
-    
-    # Remove rows with missing critical data
-    if critical_columns:
-        clean_df.dropna(subset=critical_columns, inplace=True)
+    critical_columns = [
+        col for col in ['transaction_date', 'customer_id', 'product_id'] if col in available_columns
+    ]
     
-    # Standardize date format
+    # Standardize dates to midnight so duplicates are matched per day;
+    # unparseable dates become NaT and are dropped below
     if 'transaction_date' in clean_df.columns:
         try:
-            clean_df['transaction_date'] = pd.to_datetime(clean_df['transaction_date'])
-            clean_df['transaction_date'] = clean_df['transaction_date'].dt.strftime('%Y-%m-%d')
+            missing_dates = int(clean_df['transaction_date'].isna().sum())
+            clean_df['transaction_date'] = pd.to_datetime(
+                clean_df['transaction_date'], format='ISO8601', errors='coerce', cache=True
+            ).dt.normalize()
+            unparseable_dates = int(clean_df['transaction_date'].isna().sum()) - missing_dates
+            print(f"\nUnparseable dates to be removed: {unparseable_dates}")
         except Exception as e:
             print(f"Error converting dates: {e}")
     
+    # Remove rows with missing critical data
+    if critical_columns:
+        row_count = len(clean_df)
+        clean_df.dropna(subset=critical_columns, inplace=True)
+        print(f"Rows missing critical data removed: {row_count - len(clean_df)}")
+    
+    # Fill missing dimension labels so every transaction resolves to a dimension row
+    for col in ['transaction_type', 'spend_category', 'product_category']:
+        if col in clean_df.columns:
+            missing_count = int(clean_df[col].isna().sum())
+            if missing_count:
+                clean_df[col] = clean_df[col].fillna('unknown')
+                print(f"Missing {col} values filled with 'unknown': {missing_count}")
+    
     # Remove duplicate records
-    duplicates_count = clean_df.duplicated().sum()
-    clean_df.drop_duplicates(inplace=True)
+    row_count = len(clean_df)
+    clean_df.drop_duplicates(inplace=True, ignore_index=True)
+    duplicates_count = row_count - len(clean_df)
     print(f"\nDuplicates removed: {duplicates_count}")
     
     # Clean transaction negative amounts
     if 'transaction_amount' in clean_df.columns:
-        clean_df['transaction_amount'] = pd.to_numeric(clean_df['transaction_amount'], errors='coerce')
-        negative_count = len(clean_df[clean_df['transaction_amount'] < 0])
-        clean_df = clean_df[clean_df['transaction_amount'] >= 0]
+        # Parse amounts once here; later stages rely on the float64 dtype
+        clean_df['transaction_amount'] = pd.to_numeric(
+            clean_df['transaction_amount'], errors='coerce'
+        ).astype('float64', copy=False)
+        negative_count = int((clean_df['transaction_amount'] < 0).sum())
+        clean_df.drop(index=clean_df.index[~(clean_df['transaction_amount'] >= 0)], inplace=True)
         print(f"Negative transactions removed: {negative_count}")
     
     print("\nMissing values after cleaning:")
-    print(clean_df.isnull().sum())
+    print(len(clean_df) - clean_df.count())
     print(f"\nFinal row count: {len(clean_df)}")
     
     return clean_df
@@ -88,36 +154,36 @@ def enrich_data(df):
         print("No data to enrich")
         return None
 
-    enriched_df = df.copy()
+    # Enrich in place; new columns are assigned directly onto the cleaned frame
+    enriched_df = df
     
     print("\n=== Enrichment Process ===")
     #print("Columns before enrichment:", enriched_df.columns.tolist())
     
-    # Function to categorize transaction amounts
-    def categorize_amount(amount):
-        try:
-            amount = float(amount)
-            if amount < 50:
-                return 'low'
-            elif amount <= 200:
-                return 'medium'
-            else:
-                return 'high'
-        except (ValueError, TypeError):
-            return 'unknown'
-
     # Process and categorize transaction amounts
     if 'transaction_amount' in enriched_df.columns:
         
-        # Convert amounts to numeric and create categories
-        enriched_df['transaction_amount'] = pd.to_numeric(enriched_df['transaction_amount'], errors='coerce')
-        enriched_df['amount_category'] = enriched_df['transaction_amount'].apply(categorize_amount)
+        # Create categories from the float64 amounts parsed in clean_data
+        amounts = enriched_df['transaction_amount'].to_numpy(copy=False)
+        amount_codes = np.select(
+            [amounts < 50, amounts <= 200, ~np.isnan(amounts)],
+            [0, 1, 2],
+            default=3
+        ).astype('int8')
+        enriched_df['amount_category'] = pd.Categorical.from_codes(
+            amount_codes, categories=['low', 'medium', 'high', 'unknown']
+        )
         print("\nAmount categories created:", enriched_df['amount_category'].value_counts())
 
         # Calculate customer total transactions
-        customer_totals = enriched_df.groupby('customer_id')['transaction_amount'].sum().reset_index()
-        customer_totals.columns = ['customer_id', 'total_customer_transactions']
-        enriched_df = enriched_df.merge(customer_totals, on='customer_id', how='left')
+        enriched_df['total_customer_transactions'] = (
+            enriched_df.groupby('customer_id')['transaction_amount'].transform('sum')
+        )
+
+    # Dictionary-encode low-cardinality text columns
+    for col in ['transaction_type', 'spend_category', 'product_category']:
+        if col in enriched_df.columns:
+            enriched_df[col] = enriched_df[col].astype('category')
 
     print("\nColumns after enrichment:", enriched_df.columns.tolist())
     return enriched_df
@@ -127,91 +193,81 @@ def display_data(df):
         print("No data to display")
         return
 
-    # Configure display settings
-    pd.set_option('display.max_rows', None)
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.width', None)
-
     # Display data overview
     print("\n=== Enriched Dataset Overview ===")
     print(f"Total rows: {len(df)}")
     
     
+    # Scope display settings to the sample so they don't leak globally
     print("\n=== Sample of Enriched Data ===")
-    print(df.head(10))
+    with pd.option_context('display.max_rows', 10, 'display.max_columns', None, 'display.width', None):
+        print(df.head(10))
     
     
 
 
 def get_db_connection():
-    return psycopg2.connect(
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        host=os.getenv('DB_HOST'),
-        port=os.getenv('DB_PORT')
-    )
+    global _db_pool
+    if _db_pool is None:
+        _db_pool = ThreadedConnectionPool(minconn=1, maxconn=4, **DB_KW)
+    return _db_pool.getconn()
+
+
+def release_db_connection(conn):
+    _db_pool.putconn(conn)
+
+
+def close_db_pool():
+    global _db_pool
+    if _db_pool is not None:
+        _db_pool.closeall()
+        _db_pool = None
 
 
 def save_to_database(enriched_df):
     conn = None
     try:
-        # Convert DataFrame to use Python native types
-        enriched_df = enriched_df.astype({
-            'customer_id': str,
-            'product_id': str,
-            'product_category': str,
-            'transaction_date': str,
-            'transaction_amount': float,
-            'transaction_type': str,
-            'spend_category': str,
-            'amount_category': str
-        })
-
+        # Run the whole load as one transaction without waiting on WAL flushes per commit
         conn = get_db_connection()
+        conn.autocommit = False
         cur = conn.cursor()
+        cur.execute("SET LOCAL synchronous_commit = OFF")
         
         print("\n=== Starting Database Insert Process ===")
         
-        #Insert into customers table
-        customer_query = """
+        # Insert into customers, products, transaction_types and spend_categories tables
+        # in a single round trip; each statement unnests one array parameter per column
+        dimension_query = """
         INSERT INTO customers (customer_id) 
-        VALUES (%s) 
-        ON CONFLICT (customer_id) DO NOTHING
-        """
-        customer_data = [(str(customer_id),) for customer_id in enriched_df['customer_id'].unique()]
-        execute_batch(cur, customer_query, customer_data)
-        print("✅ Customers data inserted")
+        SELECT unnest(%(customer_ids)s::text[]) 
+        ON CONFLICT (customer_id) DO NOTHING;
 
-        #Insert into products table
-        product_query = """
         INSERT INTO products (product_id, product_category) 
-        VALUES (%s, %s) 
-        ON CONFLICT (product_id) DO NOTHING
-        """
-        product_data = [(str(row['product_id']), str(row['product_category'])) 
-                       for _, row in enriched_df[['product_id', 'product_category']].drop_duplicates().iterrows()]
-        execute_batch(cur, product_query, product_data)
-        print("✅ Products data inserted")
+        SELECT * FROM unnest(%(product_ids)s::text[], %(product_categories)s::text[]) 
+        ON CONFLICT (product_id) DO NOTHING;
 
-        # Insert into transaction_types table
-        transaction_type_query = """
         INSERT INTO transaction_types (transaction_type_name) 
-        VALUES (%s) 
-        ON CONFLICT (transaction_type_name) DO NOTHING
-        """
-        transaction_type_data = [(str(type_),) for type_ in enriched_df['transaction_type'].unique()]
-        execute_batch(cur, transaction_type_query, transaction_type_data)
-        print("✅ Transaction types inserted")
+        SELECT unnest(%(transaction_types)s::text[]) 
+        ON CONFLICT (transaction_type_name) DO NOTHING;
 
-        # Insert into spend_categories table
-        spend_category_query = """
         INSERT INTO spend_categories (spend_category_name) 
-        VALUES (%s) 
-        ON CONFLICT (spend_category_name) DO NOTHING
+        SELECT unnest(%(spend_categories)s::text[]) 
+        ON CONFLICT (spend_category_name) DO NOTHING;
         """
-        spend_category_data = [(str(cat),) for cat in enriched_df['spend_category'].unique()]
-        execute_batch(cur, spend_category_query, spend_category_data)
+        customer_data = enriched_df['customer_id'].drop_duplicates().tolist()
+        product_data = enriched_df[['product_id', 'product_category']].dropna().drop_duplicates()
+        transaction_type_data = enriched_df['transaction_type'].cat.categories.tolist()
+        spend_category_data = enriched_df['spend_category'].cat.categories.tolist()
+        cur.execute(dimension_query, {
+            'customer_ids': customer_data,
+            'product_ids': product_data['product_id'].tolist(),
+            'product_categories': product_data['product_category'].tolist(),
+            'transaction_types': transaction_type_data,
+            'spend_categories': spend_category_data
+        })
+        print("✅ Customers data inserted")
+        print("✅ Products data inserted")
+        print("✅ Transaction types inserted")
         print("✅ Spend categories inserted")
 
         #Insert into amount_categories table
@@ -220,38 +276,55 @@ def save_to_database(enriched_df):
             'medium': (50, 200),
             'high': (200, 999999.99)
         }
-        for category, (min_amt, max_amt) in amount_categories.items():
-            cur.execute("""
-                INSERT INTO amount_categories (category_name, min_amount, max_amount)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (category_name) DO NOTHING
-            """, (category, float(min_amt), float(max_amt)))
+        amount_category_query = """
+        INSERT INTO amount_categories (category_name, min_amount, max_amount)
+        VALUES %s
+        ON CONFLICT (category_name) DO NOTHING
+        """
+        amount_category_data = [
+            (category, float(min_amt), float(max_amt))
+            for category, (min_amt, max_amt) in amount_categories.items()
+        ]
+        execute_values(cur, amount_category_query, amount_category_data)
         print("✅ Amount categories inserted")
 
-        #Insert into transactions table
+        #Insert into transactions table via a staging table; foreign keys are resolved with one join
+        cur.execute("""
+        CREATE TEMP TABLE stage_transactions (
+            customer_id VARCHAR(50),
+            product_id VARCHAR(50),
+            transaction_date DATE,
+            transaction_amount DECIMAL(10,2),
+            transaction_type_name VARCHAR(50),
+            spend_category_name VARCHAR(100),
+            category_name VARCHAR(20)
+        ) ON COMMIT DROP
+        """)
+        transaction_columns = [
+            'customer_id', 'product_id', 'transaction_date', 'transaction_amount',
+            'transaction_type', 'spend_category', 'amount_category'
+        ]
+        # Stream the COPY in slices so only one chunk's columns and CSV text are held in memory
+        for start in range(0, len(enriched_df), COPY_CHUNK_SIZE):
+            chunk = enriched_df.iloc[start:start + COPY_CHUNK_SIZE][transaction_columns]
+            buffer = io.StringIO()
+            chunk.to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cur.copy_expert("COPY stage_transactions FROM STDIN WITH (FORMAT CSV)", buffer)
+
+        # LEFT JOINs keep unmatched names as NULL ids so the NOT NULL constraints reject them
         transaction_query = """
         INSERT INTO transactions 
         (customer_id, product_id, transaction_date, transaction_amount, 
          transaction_type_id, spend_category_id, amount_category_id)
-        VALUES (%s, %s, %s, %s, 
-        (SELECT transaction_type_id FROM transaction_types WHERE transaction_type_name = %s),
-        (SELECT spend_category_id FROM spend_categories WHERE spend_category_name = %s),
-        (SELECT amount_category_id FROM amount_categories WHERE category_name = %s))
+        SELECT s.customer_id, s.product_id, s.transaction_date, s.transaction_amount,
+               tt.transaction_type_id, sc.spend_category_id, ac.amount_category_id
+        FROM stage_transactions s
+        LEFT JOIN transaction_types tt ON tt.transaction_type_name = s.transaction_type_name
+        LEFT JOIN spend_categories sc ON sc.spend_category_name = s.spend_category_name
+        LEFT JOIN amount_categories ac ON ac.category_name = s.category_name
         """
-        
-        transaction_data = [
-            (
-                str(row['customer_id']),
-                str(row['product_id']),
-                str(row['transaction_date']),
-                float(row['transaction_amount']),
-                str(row['transaction_type']),
-                str(row['spend_category']),
-                str(row['amount_category'])
-            )
-            for _, row in enriched_df.iterrows()
-        ]
-        execute_batch(cur, transaction_query, transaction_data)
+        cur.execute(transaction_query)
         print("✅ Transactions data inserted")
 
         conn.commit()
@@ -262,7 +335,7 @@ def save_to_database(enriched_df):
         print(f"Transaction types processed: {len(transaction_type_data)}")
         print(f"Spend categories processed: {len(spend_category_data)}")
         print(f"Amount categories processed: {len(amount_categories)}")
-        print(f"Transactions processed: {len(transaction_data)}")
+        print(f"Transactions processed: {len(enriched_df)}")
         print("\n✅ Database Insert Process Completed Successfully")
 
     except Exception as e:
@@ -276,36 +349,43 @@ def save_to_database(enriched_df):
     
     finally:
         if conn:
-            conn.close()
-            print("\nDatabase connection closed")
+            release_db_connection(conn)
+            print("\nDatabase connection released")
             
 
 def main():
     # Test database connection first
-    if not get_db_connection():
-        print("Exiting due to database connection failure")
+    try:
+        conn = get_db_connection()
+    except OperationalError as e:
+        print(f"Exiting due to database connection failure: {e}")
+        close_db_pool()
         return
+    release_db_connection(conn)
 
-  #fetch raw data
-    raw_df = get_transaction_data()
-    
-    #clean data
-    if raw_df is not None:
-        cleaned_df = clean_data(raw_df)
+    try:
+        #fetch raw data
+        raw_df = get_transaction_data()
         
-        #Enchrinch data
-        if cleaned_df is not None:
-            enriched_df = enrich_data(cleaned_df)
+        #clean data
+        if raw_df is not None:
+            cleaned_df = clean_data(raw_df)
             
-            #Display and save results
-            if enriched_df is not None:
-                display_data(enriched_df)
+            #Enchrinch data
+            if cleaned_df is not None:
+                enriched_df = enrich_data(cleaned_df)
                 
-            
+                #Display and save results
+                if enriched_df is not None:
+                    display_data(enriched_df)
+                    
                 
-                print("\nSaving data to database...")
-                save_to_database(enriched_df)
-                print("Process completed!")
+                    
+                    print("\nSaving data to database...")
+                    save_to_database(enriched_df)
+                    print("Process completed!")
+    finally:
+        close_db_pool()
 
 
 if __name__ == "__main__":